@@ -2,7 +2,9 @@ import pathlib
 
 from .configmagick_linux import *
 from .lib_bash import *
+from .lib_facts import *
 from .lib_install import *
+from .lib_journal import *
 
 
 def get_version() -> str:
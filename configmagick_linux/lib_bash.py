@@ -1,5 +1,4 @@
 # STDLIB
-import getpass
 import logging
 import os
 import pathlib
@@ -13,6 +12,12 @@ import lib_shell
 # EXT
 import psutil       # type: ignore
 
+# PROJECT
+try:
+    from . import lib_facts                     # type: ignore # pragma: no cover
+except ImportError:
+    import lib_facts                            # type: ignore # pragma: no cover
+
 logger = logging.getLogger()
 
 
@@ -46,8 +51,7 @@ def get_path_home_dir_current_user() -> pathlib.Path:
     >>> assert str(path_home_dir).startswith('/home/') or str(path_home_dir).startswith('/root') or str(path_home_dir).startswith('/Users/')
 
     """
-    username = get_current_username()
-    path_home_dir = get_path_home_dir_user(username=username)
+    path_home_dir = pathlib.Path(lib_facts.get_host_facts().path_home_dir)
     return path_home_dir
 
 
@@ -62,7 +66,7 @@ def get_path_home_dir_user(username: str) -> pathlib.Path:
 
 
 def get_current_username() -> str:
-    username = getpass.getuser()
+    username = lib_facts.get_host_facts().username
     return username
 
 
@@ -71,8 +75,10 @@ def get_linux_release_name() -> str:
     >>> assert get_linux_release_name() is not None
 
     """
-    linux_release_name = lib_shell.run_shell_command('lsb_release -c -s', quiet=True).stdout
-    return str(linux_release_name)
+    linux_release_name = lib_facts.get_host_facts().linux_release_name
+    if not linux_release_name:
+        raise RuntimeError('can not determine the linux release name')
+    return linux_release_name
 
 
 def get_linux_release_number() -> str:
@@ -81,8 +87,10 @@ def get_linux_release_number() -> str:
     >>> assert '.' in get_linux_release_number()
 
     """
-    release = lib_shell.run_shell_command('lsb_release -r -s', quiet=True).stdout
-    return str(release)
+    release = lib_facts.get_host_facts().linux_release_number
+    if not release:
+        raise RuntimeError('can not determine the linux release number')
+    return release
 
 
 def get_linux_release_number_major() -> str:
@@ -106,9 +114,8 @@ def get_env_display() -> str:
 
     >>> assert get_env_display() is not None
     """
-    if 'DISPLAY' in os.environ:
-        display = str(os.environ['DISPLAY'])
-    else:
+    display = lib_facts.get_host_facts().env_display
+    if not display:
         raise RuntimeError('can not get environment DISPLAY variable')
     return display
 
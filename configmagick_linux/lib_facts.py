@@ -0,0 +1,282 @@
+# STDLIB
+import getpass
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+logger = logging.getLogger()
+
+
+class ConfFacts(object):
+    def __init__(self) -> None:
+        self.use_disk_cache = True                                                                              # type: bool
+        self.cache_ttl_seconds = 3600                                                                           # type: Union[int, float]
+        # the cache directory of the host facts and the journal
+        # None = "$XDG_CACHE_HOME/configmagick_linux" or "~/.cache/configmagick_linux" of the current user
+        self.path_cache_dir = None                                                                              # type: Union[pathlib.Path, None]
+        self.path_boot_id = pathlib.Path('/proc/sys/kernel/random/boot_id')                                     # type: pathlib.Path
+        self.path_os_release = pathlib.Path('/etc/os-release')                                                  # type: pathlib.Path
+        # environment variables the facts are derived from - a change of any of them invalidates the disk cache
+        self.l_env_variables = ['LOGNAME', 'USER', 'LNAME', 'USERNAME', 'HOME', 'DISPLAY', 'TRAVIS']            # type: List[str]
+
+
+conf_facts = ConfFacts()
+
+
+class HostFacts(object):
+    def __init__(self) -> None:
+        self.username = ''                  # type: str
+        self.path_home_dir = ''             # type: str
+        self.linux_release_name = ''        # type: str
+        self.linux_release_number = ''      # type: str
+        self.env_display = ''               # type: str     # empty if DISPLAY is not set
+        self.is_on_travis = False           # type: bool
+        self.timestamp = 0.0                # type: float
+        self.invalidation_key = ''          # type: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, d_facts: Dict[str, Any]) -> 'HostFacts':
+        host_facts = cls()
+        for key in host_facts.__dict__:
+            if key not in d_facts:
+                raise ValueError('host facts key "{key}" is missing'.format(key=key))
+            setattr(host_facts, key, d_facts[key])
+        return host_facts
+
+
+_host_facts = None                          # type: Union[HostFacts, None]
+# the values of conf_facts.l_env_variables the in-process facts were gathered with
+_host_facts_env = ()                        # type: Tuple[Any, ...]
+_host_facts_lock = threading.Lock()
+# the encoded keys of conf_facts.l_env_variables, see _get_env
+_env_keys_source = None                     # type: Union[List[str], None]
+_l_env_keys_encoded = []                    # type: List[Any]
+# the boot id can not change while the process runs
+_boot_id = None                             # type: Union[str, None]
+
+
+def get_host_facts(refresh: bool = False) -> HostFacts:
+    """
+    returns the host facts, gathered once per process and shared between processes via the disk cache.
+    the facts are gathered again when the ttl expired or the invalidation key (boot, os-release, user, environment) changed
+
+    >>> host_facts = get_host_facts()
+    >>> assert host_facts is get_host_facts()
+    >>> assert host_facts.username
+    >>> assert get_host_facts(refresh=True) is not host_facts
+    >>> import os
+    >>> display_save = os.environ.get('DISPLAY')
+    >>> os.environ['DISPLAY'] = ':99'
+    >>> assert get_host_facts().env_display == ':99'
+    >>> if display_save is None:
+    ...     del os.environ['DISPLAY']
+    ... else:
+    ...     os.environ['DISPLAY'] = display_save
+
+    """
+    global _host_facts, _host_facts_env
+    # fast path without lock - only the environment and the ttl are checked, boot id and os-release only when the ttl expired
+    host_facts = _host_facts
+    env = _get_env()
+    if (not refresh and host_facts is not None and env == _host_facts_env
+            and time.time() - host_facts.timestamp <= conf_facts.cache_ttl_seconds):
+        return host_facts
+
+    with _host_facts_lock:
+        invalidation_key = get_invalidation_key()
+        host_facts = None
+        if not refresh:
+            host_facts = read_host_facts_from_disk_cache(invalidation_key=invalidation_key)
+        if host_facts is None:
+            host_facts = gather_host_facts(invalidation_key=invalidation_key)
+            write_host_facts_to_disk_cache(host_facts)
+        _host_facts, _host_facts_env = host_facts, env
+        return host_facts
+
+
+def invalidate_host_facts() -> None:
+    """
+    drops the in-process facts and removes the disk cache
+
+    >>> invalidate_host_facts()
+    >>> assert not get_path_cache_file().exists()
+    >>> assert get_host_facts().username
+
+    """
+    global _host_facts
+    with _host_facts_lock:
+        _host_facts = None
+        try:
+            get_path_cache_file().unlink()
+        except FileNotFoundError:
+            pass
+
+
+def gather_host_facts(invalidation_key: str = '') -> HostFacts:
+    """
+    gathers all host facts in one pass
+
+    >>> host_facts = gather_host_facts()
+    >>> assert host_facts.linux_release_number
+    >>> assert host_facts.linux_release_name
+
+    """
+    host_facts = HostFacts()
+    host_facts.username = getpass.getuser()
+    host_facts.path_home_dir = os.path.expanduser("~{username}".format(username=host_facts.username))
+    # the release fields stay empty if they can not be determined - the release getters raise then
+    d_os_release = read_os_release()
+    host_facts.linux_release_number = d_os_release.get('VERSION_ID', '')
+    host_facts.linux_release_name = d_os_release.get('VERSION_CODENAME', '') or d_os_release.get('UBUNTU_CODENAME', '')
+    host_facts.env_display = str(os.environ.get('DISPLAY', ''))
+    host_facts.is_on_travis = str(os.environ.get('TRAVIS', '')).lower() == 'true'
+    host_facts.timestamp = time.time()
+    host_facts.invalidation_key = invalidation_key
+    return host_facts
+
+
+def read_os_release() -> Dict[str, str]:
+    """
+    returns the key/value pairs of /etc/os-release, or an empty dict if it can not be read
+
+    >>> assert 'ID' in read_os_release()
+    """
+    d_os_release = dict()                                       # type: Dict[str, str]
+    try:
+        os_release = conf_facts.path_os_release.read_text()
+    except OSError:
+        return d_os_release
+    for line in os_release.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        d_os_release[key.strip()] = value.strip().strip('"').strip("'")
+    return d_os_release
+
+
+def get_invalidation_key() -> str:
+    """
+    the disk cache is only valid for the same boot, the same /etc/os-release, the same user and the same relevant environment
+
+    >>> assert get_invalidation_key() == get_invalidation_key()
+
+    """
+    global _boot_id
+    if _boot_id is None:
+        try:
+            _boot_id = conf_facts.path_boot_id.read_text().strip()
+        except OSError:
+            _boot_id = ''
+    try:
+        os_release_mtime = conf_facts.path_os_release.stat().st_mtime
+    except OSError:
+        os_release_mtime = 0.0
+    d_env = {env_variable: os.environ.get(env_variable, '') for env_variable in conf_facts.l_env_variables}
+    invalidation_key = json.dumps([_boot_id, os_release_mtime, os.getuid(), d_env], sort_keys=True)
+    return invalidation_key
+
+
+def get_path_cache_dir(create: bool = False) -> pathlib.Path:
+    """
+    returns the cache directory of configmagick_linux, if create is set it is created (only accessible by the user)
+
+    >>> assert get_path_cache_dir().name == 'configmagick_linux' or conf_facts.path_cache_dir is not None
+    """
+    if conf_facts.path_cache_dir is not None:
+        path_cache_dir = pathlib.Path(conf_facts.path_cache_dir)
+    else:
+        path_cache_dir = pathlib.Path(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')) / 'configmagick_linux'
+    if create:
+        path_cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+    return path_cache_dir
+
+
+def get_path_cache_file() -> pathlib.Path:
+    path_cache_file = get_path_cache_dir() / 'host_facts_{uid}.json'.format(uid=os.getuid())
+    return path_cache_file
+
+
+def _get_env() -> Tuple[Any, ...]:
+    """
+    returns the raw values of conf_facts.l_env_variables - only used to detect changes of the environment.
+    os.environ.get encodes every key, so the values are read from the underlying mapping with keys encoded once.
+
+    >>> assert _get_env() == _get_env()
+    """
+    global _env_keys_source, _l_env_keys_encoded
+    d_environ = getattr(os.environ, '_data', None)
+    encodekey = getattr(os.environ, 'encodekey', None)
+    if d_environ is None or encodekey is None:
+        return tuple(os.environ.get(env_variable) for env_variable in conf_facts.l_env_variables)
+    if _env_keys_source is not conf_facts.l_env_variables:
+        _l_env_keys_encoded = [encodekey(env_variable) for env_variable in conf_facts.l_env_variables]
+        _env_keys_source = conf_facts.l_env_variables
+    return tuple(map(d_environ.get, _l_env_keys_encoded))
+
+
+def _is_host_facts_valid(host_facts: Union[HostFacts, None], invalidation_key: str) -> bool:
+    if host_facts is None:
+        return False
+    if host_facts.invalidation_key != invalidation_key:
+        return False
+    if time.time() - host_facts.timestamp > conf_facts.cache_ttl_seconds:
+        return False
+    return True
+
+
+def read_host_facts_from_disk_cache(invalidation_key: str) -> Union[HostFacts, None]:
+    """
+    returns None if there is no valid disk cache
+
+    >>> write_host_facts_to_disk_cache(gather_host_facts(invalidation_key='test'))
+    >>> assert read_host_facts_from_disk_cache(invalidation_key='test') is not None
+    >>> assert read_host_facts_from_disk_cache(invalidation_key='other') is None
+    >>> invalidate_host_facts()
+    >>> assert read_host_facts_from_disk_cache(invalidation_key='test') is None
+
+    """
+    if not conf_facts.use_disk_cache:
+        return None
+    path_cache_file = get_path_cache_file()
+    # noinspection PyBroadException
+    try:
+        # only trust our own files
+        if path_cache_file.stat().st_uid != os.getuid():
+            return None
+        host_facts = HostFacts.from_dict(json.loads(path_cache_file.read_text()))
+    except Exception:
+        return None
+    if not _is_host_facts_valid(host_facts, invalidation_key=invalidation_key):
+        return None
+    return host_facts
+
+
+def write_host_facts_to_disk_cache(host_facts: HostFacts) -> None:
+    if not conf_facts.use_disk_cache:
+        return
+    path_cache_file = get_path_cache_file()
+    path_tmp_file = None                                        # type: Union[str, None]
+    try:
+        get_path_cache_dir(create=True)
+        # mkstemp creates the file exclusively, it never follows an existing file or symlink
+        fd, path_tmp_file = tempfile.mkstemp(dir=str(path_cache_file.parent), prefix=path_cache_file.name, suffix='.tmp')
+        with os.fdopen(fd, mode='w') as tmp_file:
+            tmp_file.write(json.dumps(host_facts.to_dict()))
+        os.replace(path_tmp_file, str(path_cache_file))
+    except OSError:
+        # the cache is only an optimization
+        logger.debug('can not write host facts cache "{path_cache_file}"'.format(path_cache_file=path_cache_file))
+        if path_tmp_file is not None:
+            try:
+                os.unlink(path_tmp_file)
+            except OSError:
+                pass
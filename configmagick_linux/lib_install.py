@@ -1,9 +1,10 @@
 # ##### STDLIB
+import concurrent.futures
+import hashlib
 import logging
-import os
 import pathlib
 import time
-from typing import List, Union
+from typing import Dict, List, Tuple, Union
 
 # ##### OWN
 import lib_regexp
@@ -12,17 +13,25 @@ import lib_shell
 # ##### PROJECT
 try:
     from . import lib_bash                      # type: ignore # pragma: no cover
+    from . import lib_facts                     # type: ignore # pragma: no cover
+    from . import lib_journal                   # type: ignore # pragma: no cover
 except ImportError:
     import lib_bash                             # type: ignore # pragma: no cover
+    import lib_facts                            # type: ignore # pragma: no cover
+    import lib_journal                          # type: ignore # pragma: no cover
 
 
 class ConfInstall(object):
     def __init__(self) -> None:
         self.apt_command = 'apt-get'                                # type: str
+        self.path_dpkg_status = pathlib.Path('/var/lib/dpkg/status')  # type: pathlib.Path
 
 
 conf_install = ConfInstall()
 
+# sha256 of the dpkg status database for (path, size, mtime_ns)
+_d_dpkg_status_sha256 = dict()                                      # type: Dict[Tuple[str, int, int], str]
+
 
 logger = logging.getLogger()
 
@@ -68,6 +77,11 @@ def install_linux_package(package: str, parameters: List[str] = [], quiet: bool
     """
 
     result = lib_shell.ShellCommandResponse()
+    start_time = time.time()
+    # if the dpkg status did not change since the last successful install, the package is still installed
+    if not reinstall and lib_journal.is_operation_converged('install', package, get_dpkg_status_fingerprint()):
+        return result
+
     if not is_package_installed(package) or reinstall:
 
         if reinstall:
@@ -77,15 +91,217 @@ def install_linux_package(package: str, parameters: List[str] = [], quiet: bool
 
         l_command = l_command + parameters
 
-        result = lib_shell.run_shell_ls_command(ls_command=l_command,
-                                                shell=True,
-                                                quiet=quiet,
-                                                use_sudo=use_sudo,
-                                                raise_on_returncode_not_zero=raise_on_returncode_not_zero,
-                                                pass_stdout_stderr_to_sys=True)
+        result = _run_journaled_apt_command(operation='install', l_packages=[package], l_command=l_command, start_time=start_time,
+                                            quiet=quiet, use_sudo=use_sudo, raise_on_returncode_not_zero=raise_on_returncode_not_zero)
+    else:
+        lib_journal.record_operation('install', package, start_time=start_time, outcome='satisfied', fingerprint=get_dpkg_status_fingerprint())
+    return result
+
+
+class DebInfo(object):
+    def __init__(self, path_deb: pathlib.Path) -> None:
+        self.path_deb = path_deb            # type: pathlib.Path
+        self.package = ''                   # type: str
+        self.version = ''                   # type: str
+        self.architecture = ''              # type: str
+        self.sha256 = ''                    # type: str
+
+
+def install_local_debs(debs: Union[str, pathlib.Path, List[Union[str, pathlib.Path]]],
+                       sha256_sums: Union[Dict[str, str], None] = None,
+                       parameters: List[str] = [],
+                       quiet: bool = False,
+                       reinstall: bool = False,
+                       use_sudo: bool = True,
+                       raise_on_returncode_not_zero: bool = True,
+                       max_workers: Union[int, None] = None,
+                       require_sha256: bool = True) -> lib_shell.ShellCommandResponse:
+    """
+    installs local .deb files (a list of files, or all *.deb files of a directory) in one apt transaction,
+    so dependencies between them resolve together.
+
+    control metadata and sha256 hashes are verified in a thread pool before anything is installed.
+    the expected hash is taken from sha256_sums {<file name>: <sha256>} or from a "<file name>.sha256" file next to the deb.
+    if there is no expected hash for a deb, it raises - or with require_sha256=False logs a warning and does not verify the hash.
+    debs whose exact version is already installed (according to the dpkg status database) are skipped, unless reinstall is set.
+
+    >>> result = install_local_debs([])
+    >>> assert result.returncode == 0
+    >>> import unittest
+    >>> unittest.TestCase().assertRaises(FileNotFoundError, install_local_debs, '/unknown.deb')
+    """
+
+    l_path_debs = get_local_deb_paths(debs)
+    l_deb_infos = verify_local_debs(l_path_debs, sha256_sums=sha256_sums, max_workers=max_workers, require_sha256=require_sha256)
+
+    if not reinstall:
+        l_deb_infos = filter_installed_debs(l_deb_infos)
+
+    result = lib_shell.ShellCommandResponse()
+    if l_deb_infos:
+        l_command = [conf_install.apt_command, 'install']
+        if reinstall:
+            l_command.append('--reinstall')
+        l_command = l_command + [str(deb_info.path_deb) for deb_info in l_deb_infos] + ['-y'] + parameters
+        # the journal gets the duration of the whole transaction for every deb
+        # the file names come from the caller or from globbing a directory, so they must not pass a shell
+        result = _run_journaled_apt_command(operation='install_deb', l_packages=[deb_info.package for deb_info in l_deb_infos],
+                                            l_command=l_command, start_time=time.time(), quiet=quiet, use_sudo=use_sudo,
+                                            raise_on_returncode_not_zero=raise_on_returncode_not_zero, shell=False)
     return result
 
 
+def filter_installed_debs(l_deb_infos: List[DebInfo]) -> List[DebInfo]:
+    """
+    returns the debs whose exact package, architecture and version is not installed yet
+
+    >>> (package, architecture), version = next(iter(get_dpkg_installed_versions().items()))
+    >>> deb_info_installed = DebInfo(path_deb=pathlib.Path('installed.deb'))
+    >>> deb_info_installed.package, deb_info_installed.architecture, deb_info_installed.version = package, architecture, version
+    >>> deb_info_other_version = DebInfo(path_deb=pathlib.Path('other_version.deb'))
+    >>> deb_info_other_version.package, deb_info_other_version.architecture, deb_info_other_version.version = package, architecture, version + '.1'
+    >>> assert filter_installed_debs([deb_info_installed, deb_info_other_version]) == [deb_info_other_version]
+    """
+    d_installed_versions = get_dpkg_installed_versions()
+    l_deb_infos = [deb_info for deb_info in l_deb_infos
+                   if d_installed_versions.get((deb_info.package, deb_info.architecture)) != deb_info.version]
+    return l_deb_infos
+
+
+def get_local_deb_paths(debs: Union[str, pathlib.Path, List[Union[str, pathlib.Path]]]) -> List[pathlib.Path]:
+    """
+    returns the absolute paths of the debs - a directory is expanded to the *.deb files in it
+
+    >>> assert get_local_deb_paths([]) == []
+    """
+    if isinstance(debs, (str, pathlib.Path)):
+        debs = [debs]
+    l_path_debs = []                                                # type: List[pathlib.Path]
+    for deb in debs:
+        path_deb = pathlib.Path(deb).resolve()
+        if path_deb.is_dir():
+            l_path_debs = l_path_debs + sorted(path_deb.glob('*.deb'))
+        elif path_deb.is_file():
+            l_path_debs.append(path_deb)
+        else:
+            raise FileNotFoundError('deb file "{path_deb}" not found'.format(path_deb=path_deb))
+    return l_path_debs
+
+
+def verify_local_debs(l_path_debs: List[pathlib.Path],
+                      sha256_sums: Union[Dict[str, str], None] = None,
+                      max_workers: Union[int, None] = None,
+                      require_sha256: bool = True) -> List[DebInfo]:
+    """
+    reads the control metadata and verifies the sha256 hashes of the debs in a thread pool, raises on the first error
+
+    >>> assert verify_local_debs([]) == []
+    >>> import tempfile, unittest
+    >>> path_deb = pathlib.Path(tempfile.mkdtemp()) / 'test.deb'
+    >>> _ = path_deb.write_bytes(b'test')
+    >>> unittest.TestCase().assertRaisesRegex(RuntimeError, 'does not match', verify_local_debs, [path_deb], sha256_sums={'test.deb': '0' * 64})
+    """
+    if not l_path_debs:
+        return []
+    if sha256_sums is None:
+        sha256_sums = dict()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        l_futures = [executor.submit(verify_local_deb, path_deb, sha256_sums.get(path_deb.name, ''), require_sha256) for path_deb in l_path_debs]
+        l_deb_infos = [future.result() for future in l_futures]
+    return l_deb_infos
+
+
+def verify_local_deb(path_deb: pathlib.Path, expected_sha256: str = '', require_sha256: bool = True) -> DebInfo:
+    """
+    >>> import tempfile, unittest
+    >>> path_deb = pathlib.Path(tempfile.mkdtemp()) / 'test.deb'
+    >>> _ = path_deb.write_bytes(b'test')
+    >>> path_sha256_file = path_deb.with_name('test.deb.sha256')
+
+    >>> # no expected hash
+    >>> unittest.TestCase().assertRaisesRegex(RuntimeError, 'no sha256', verify_local_deb, path_deb)
+    >>> # not verified, but the fake deb has no control metadata
+    >>> unittest.TestCase().assertRaisesRegex(RuntimeError, 'control metadata', verify_local_deb, path_deb, require_sha256=False)
+
+    >>> _ = path_sha256_file.write_text('{sha256}  test.deb'.format(sha256='0' * 64))
+    >>> unittest.TestCase().assertRaisesRegex(RuntimeError, 'does not match', verify_local_deb, path_deb)
+    >>> _ = path_sha256_file.write_text(' ')
+    >>> unittest.TestCase().assertRaisesRegex(RuntimeError, 'is empty', verify_local_deb, path_deb)
+    >>> _ = path_sha256_file.write_text(get_sha256_of_file(path_deb))
+    >>> unittest.TestCase().assertRaisesRegex(RuntimeError, 'control metadata', verify_local_deb, path_deb)
+    """
+    deb_info = DebInfo(path_deb=path_deb)
+
+    path_sha256_file = path_deb.with_name(path_deb.name + '.sha256')
+    if not expected_sha256 and path_sha256_file.is_file():
+        # format of "sha256sum" : "<hash>  <file name>"
+        l_sha256_fields = path_sha256_file.read_text().split()
+        if not l_sha256_fields:
+            raise RuntimeError('sha256 of deb file "{path_deb}" does not match, "{path_sha256_file}" is empty'
+                               .format(path_deb=path_deb, path_sha256_file=path_sha256_file))
+        expected_sha256 = l_sha256_fields[0]
+
+    if expected_sha256:
+        deb_info.sha256 = get_sha256_of_file(path_deb)
+        if expected_sha256.lower() != deb_info.sha256:
+            raise RuntimeError('sha256 of deb file "{path_deb}" does not match'.format(path_deb=path_deb))
+    elif require_sha256:
+        raise RuntimeError('no sha256 for deb file "{path_deb}" in sha256_sums or "{path_sha256_file}"'
+                           .format(path_deb=path_deb, path_sha256_file=path_sha256_file))
+    else:
+        logger.warning('sha256 of deb file "{path_deb}" is not verified, there is no expected hash'.format(path_deb=path_deb))
+
+    response = lib_shell.run_shell_ls_command(ls_command=['dpkg-deb', '--field', str(path_deb), 'Package', 'Version', 'Architecture'],
+                                              log_settings=lib_shell.conf_lib_shell.log_settings_qquiet,
+                                              raise_on_returncode_not_zero=False)
+    d_fields = _parse_dpkg_paragraph(str(response.stdout))
+    deb_info.package = d_fields.get('Package', '')
+    deb_info.version = d_fields.get('Version', '')
+    deb_info.architecture = d_fields.get('Architecture', '')
+    if response.returncode or not (deb_info.package and deb_info.version and deb_info.architecture):
+        raise RuntimeError('can not read control metadata of deb file "{path_deb}"'.format(path_deb=path_deb))
+    return deb_info
+
+
+def get_sha256_of_file(path_file: pathlib.Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(str(path_file), mode='rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_dpkg_installed_versions() -> Dict[Tuple[str, str], str]:
+    """
+    returns {(package, architecture): version} of all installed packages, read from the dpkg status database
+
+    >>> d_installed_versions = get_dpkg_installed_versions()
+    >>> assert any(package == 'apt' for package, architecture in d_installed_versions)
+    """
+    d_installed_versions = dict()                                   # type: Dict[Tuple[str, str], str]
+    with open(str(conf_install.path_dpkg_status), mode='r', encoding='utf-8', errors='replace') as dpkg_status_file:
+        dpkg_status = dpkg_status_file.read()
+    for paragraph in dpkg_status.split('\n\n'):
+        d_fields = _parse_dpkg_paragraph(paragraph)
+        if d_fields.get('Status', '').endswith(' installed') and 'Package' in d_fields:
+            d_installed_versions[(d_fields['Package'], d_fields.get('Architecture', ''))] = d_fields.get('Version', '')
+    return d_installed_versions
+
+
+def _parse_dpkg_paragraph(paragraph: str) -> Dict[str, str]:
+    r"""
+    >>> assert _parse_dpkg_paragraph('Package: apt\nDescription: a\n b\nVersion: 1.0') == {'Package': 'apt', 'Description': 'a', 'Version': '1.0'}
+    """
+    d_fields = dict()                                               # type: Dict[str, str]
+    for line in paragraph.splitlines():
+        # continuation lines of multiline fields start with a space or tab
+        if not line or line[0] in ' \t' or ':' not in line:
+            continue
+        key, value = line.split(':', 1)
+        d_fields[key] = value.strip()
+    return d_fields
+
+
 def uninstall_linux_packages(packages: List[str],
                              quiet: bool = False,
                              use_sudo: bool = True,
@@ -103,19 +319,58 @@ def uninstall_linux_package(package: str,
                             raise_on_returncode_not_zero: bool = True) -> lib_shell.ShellCommandResponse:
 
     result = lib_shell.ShellCommandResponse()
+    start_time = time.time()
+    # if the dpkg status did not change since the last successful uninstall, the package is still not installed
+    if lib_journal.is_operation_converged('uninstall', package, get_dpkg_status_fingerprint()):
+        return result
 
     if is_package_installed(package) or is_wildcard_in_package_name(package):
         l_command = [conf_install.apt_command, 'purge', package, '-y']
 
+        result = _run_journaled_apt_command(operation='uninstall', l_packages=[package], l_command=l_command, start_time=start_time,
+                                            quiet=quiet, use_sudo=use_sudo, raise_on_returncode_not_zero=raise_on_returncode_not_zero)
+    else:
+        lib_journal.record_operation('uninstall', package, start_time=start_time, outcome='satisfied', fingerprint=get_dpkg_status_fingerprint())
+    return result
+
+
+def _run_journaled_apt_command(operation: str, l_packages: List[str], l_command: List[str], start_time: float, quiet: bool,
+                               use_sudo: bool, raise_on_returncode_not_zero: bool, shell: bool = True) -> lib_shell.ShellCommandResponse:
+    outcome = 'failed'
+    try:
         result = lib_shell.run_shell_ls_command(ls_command=l_command,
-                                                shell=True,
+                                                shell=shell,
                                                 quiet=quiet,
                                                 use_sudo=use_sudo,
                                                 raise_on_returncode_not_zero=raise_on_returncode_not_zero,
                                                 pass_stdout_stderr_to_sys=True)
+        if result.returncode == 0:
+            outcome = 'ok'
+    finally:
+        fingerprint = get_dpkg_status_fingerprint()
+        for package in l_packages:
+            lib_journal.record_operation(operation, package, start_time=start_time, outcome=outcome, fingerprint=fingerprint)
     return result
 
 
+def get_dpkg_status_fingerprint() -> str:
+    """
+    returns "<size>:<mtime_ns>:<sha256>" of the dpkg status database, the hash is computed once per size and mtime
+
+    >>> assert get_dpkg_status_fingerprint() == get_dpkg_status_fingerprint()
+    """
+    try:
+        stat_result = conf_install.path_dpkg_status.stat()
+    except OSError:
+        return ''
+    key = (str(conf_install.path_dpkg_status), stat_result.st_size, stat_result.st_mtime_ns)
+    if key not in _d_dpkg_status_sha256:
+        _d_dpkg_status_sha256.clear()
+        _d_dpkg_status_sha256[key] = get_sha256_of_file(conf_install.path_dpkg_status)
+    fingerprint = '{size}:{mtime_ns}:{sha256}'.format(size=stat_result.st_size, mtime_ns=stat_result.st_mtime_ns, sha256=_d_dpkg_status_sha256[key])
+    return fingerprint
+
+
 def full_update_and_upgrade(quiet: bool = False) -> None:
     lib_shell.run_shell_command('{apt_command} update'.format(apt_command=conf_install.apt_command),
                                 use_sudo=True, shell=True, pass_stdout_stderr_to_sys=True, quiet=quiet)
@@ -195,10 +450,7 @@ def is_on_travis() -> bool:
     """
     >>> assert is_on_travis() is not None
     """
-    is_travis = False
-    if 'TRAVIS' in os.environ:                                  # pragma: no cover
-        if str(os.environ['TRAVIS']).lower() == 'true':
-            is_travis = True
+    is_travis = lib_facts.get_host_facts().is_on_travis
     return is_travis
 
 
@@ -243,9 +495,12 @@ def start_service(service: str, quiet: bool = False) -> None:
     if not is_service_installed(service=service):
         raise RuntimeError('can not start service "{service}", because it is not installed'.format(service=service))
     if not is_service_active(service=service):
+        start_time = time.time()
         lib_shell.run_shell_command(command='service {service} start'.format(service=service), shell=True, use_sudo=True, quiet=quiet)
         if not is_service_active(service=service):
+            lib_journal.record_operation('start_service', service, start_time=start_time, outcome='failed')
             raise RuntimeError('can not start service "{service}"'.format(service=service))
+        lib_journal.record_operation('start_service', service, start_time=start_time, outcome='ok')
 
 
 def stop_service(service: str, quiet: bool = False) -> None:
@@ -256,9 +511,173 @@ def stop_service(service: str, quiet: bool = False) -> None:
     if not is_service_installed(service=service):
         raise RuntimeError('can not stop service "{service}", because it is not installed'.format(service=service))
     if is_service_active(service=service):
+        start_time = time.time()
         lib_shell.run_shell_command(command='service {service} stop'.format(service=service), shell=True, use_sudo=True, quiet=quiet)
         if is_service_active(service=service):
+            lib_journal.record_operation('stop_service', service, start_time=start_time, outcome='failed')
             raise RuntimeError('can not stop service "{service}"'.format(service=service))
+        lib_journal.record_operation('stop_service', service, start_time=start_time, outcome='ok')
+
+
+def start_services(services: List[str], quiet: bool = False, max_wait: Union[int, float] = 90,
+                   check_interval: Union[int, float] = 0.5, raise_on_error: bool = True) -> Dict[str, bool]:
+    """
+    starts all services with one "systemctl start --no-block" and waits for them concurrently,
+    with a shared timeout. returns for each service if it is active.
+
+    >>> import unittest
+    >>> assert start_services([]) == {}
+    >>> unittest.TestCase().assertRaises(RuntimeError, start_services, services=['unknown'])
+    >>> assert start_services(['unknown'], raise_on_error=False) == {'unknown': False}
+    >>> if is_service_installed('ssh'):
+    ...     is_ssh_active = is_service_active('ssh')
+    ...     assert stop_services(['ssh']) == {'ssh': True}
+    ...     assert not is_service_active('ssh')
+    ...     assert start_services(['ssh']) == {'ssh': True}
+    ...     assert is_service_active('ssh')
+    ...     if not is_ssh_active:
+    ...         result = stop_services(['ssh'])
+
+    """
+    d_results = _change_services_state(services=services, action='start', quiet=quiet, max_wait=max_wait,
+                                       check_interval=check_interval, raise_on_error=raise_on_error)
+    return d_results
+
+
+def stop_services(services: List[str], quiet: bool = False, max_wait: Union[int, float] = 90,
+                  check_interval: Union[int, float] = 0.5, raise_on_error: bool = True) -> Dict[str, bool]:
+    """
+    stops all services with one "systemctl stop --no-block" and waits for them concurrently,
+    with a shared timeout. returns for each service if it is stopped.
+
+    >>> import unittest
+    >>> assert stop_services([]) == {}
+    >>> unittest.TestCase().assertRaises(RuntimeError, stop_services, services=['unknown'])
+    >>> assert stop_services(['unknown'], raise_on_error=False) == {'unknown': False}
+    """
+    d_results = _change_services_state(services=services, action='stop', quiet=quiet, max_wait=max_wait,
+                                       check_interval=check_interval, raise_on_error=raise_on_error)
+    return d_results
+
+
+def get_services_state(services: List[str]) -> Dict[str, str]:
+    """
+    returns the state ('active', 'inactive', 'activating', 'failed', ...) of all services, with one subprocess
+
+    >>> assert get_services_state([]) == {}
+    >>> assert get_services_state(['unknown']) != {'unknown': 'active'}
+    """
+    d_states = {service: d_properties.get('ActiveState', '') for service, d_properties in get_services_properties(services).items()}
+    return d_states
+
+
+def get_services_properties(services: List[str]) -> Dict[str, Dict[str, str]]:
+    """
+    returns the properties ActiveState, Result, Job and InactiveExitTimestampMonotonic of all services, with one subprocess.
+    Job is empty or '0' if no job is queued for the service.
+
+    >>> assert get_services_properties([]) == {}
+    >>> assert 'ActiveState' in get_services_properties(['unknown'])['unknown']
+    """
+    if not services:
+        return {}
+    l_command = ['systemctl', 'show', '--property=Id,ActiveState,Result,Job,InactiveExitTimestampMonotonic'] + services
+    response = lib_shell.run_shell_ls_command(ls_command=l_command, log_settings=lib_shell.conf_lib_shell.log_settings_qquiet,
+                                              raise_on_returncode_not_zero=False)
+    # one block per service, in the order of the arguments, separated by an empty line
+    l_blocks = [block for block in str(response.stdout).split('\n\n') if block.strip()]
+    if len(l_blocks) != len(services):
+        raise RuntimeError('can not determine the state of services "{services}"'.format(services=', '.join(services)))
+    d_services_properties = dict()                                  # type: Dict[str, Dict[str, str]]
+    for service, block in zip(services, l_blocks):
+        d_properties = dict()                                       # type: Dict[str, str]
+        for line in block.splitlines():
+            if '=' in line:
+                key, value = line.split('=', 1)
+                d_properties[key.strip()] = value.strip()
+        d_services_properties[service] = d_properties
+    return d_services_properties
+
+
+def _change_services_state(services: List[str], action: str, quiet: bool, max_wait: Union[int, float],
+                           check_interval: Union[int, float], raise_on_error: bool) -> Dict[str, bool]:
+    if not services:
+        return {}
+
+    response = lib_shell.run_shell_command(command='systemctl list-units --full -all', shell=True, raise_on_returncode_not_zero=False,
+                                           log_settings=lib_shell.conf_lib_shell.log_settings_qquiet)
+    l_not_installed = [service for service in services if '{service}.service'.format(service=service) not in str(response.stdout)]
+    if l_not_installed and raise_on_error:
+        raise RuntimeError('can not {action} services "{services}", because they are not installed'
+                           .format(action=action, services=', '.join(l_not_installed)))
+    d_results = {service: service not in l_not_installed for service in services}
+    l_installed = [service for service in services if service not in l_not_installed]
+
+    if action == 'start':
+        l_target_states = ['active']
+    else:
+        # a service that exits with an error on stop ends up as "failed", but it is stopped anyway
+        l_target_states = ['inactive', 'failed']
+
+    d_properties_before = get_services_properties(l_installed)
+    l_pending = [service for service, d_properties in d_properties_before.items() if d_properties.get('ActiveState', '') not in l_target_states]
+    if l_pending:
+        if action == 'start':
+            # otherwise a unit that failed before would look failed until its queued start job runs
+            lib_shell.run_shell_ls_command(ls_command=['systemctl', 'reset-failed'] + l_pending, use_sudo=True,
+                                           log_settings=lib_shell.conf_lib_shell.log_settings_qquiet, raise_on_returncode_not_zero=False)
+        # a unit that can not be queued (masked, ...) must not abort the others - it shows up as done without success
+        l_command = ['systemctl', action, '--no-block'] + l_pending
+        lib_shell.run_shell_ls_command(ls_command=l_command, use_sudo=True, quiet=quiet, raise_on_returncode_not_zero=False)
+
+    start_time = time.time()
+    operation = '{action}_service'.format(action=action)
+    while l_pending:
+        time.sleep(check_interval)
+        for service, d_properties in get_services_properties(l_pending).items():
+            is_done, is_ok = _is_service_job_done(action=action, d_properties=d_properties, d_properties_before=d_properties_before[service])
+            if is_done:
+                l_pending.remove(service)
+                d_results[service] = is_ok
+                lib_journal.record_operation(operation, service, start_time=start_time, outcome='ok' if is_ok else 'failed')
+        if l_pending and time.time() - start_time > max_wait:
+            for service in l_pending:
+                d_results[service] = False
+                lib_journal.record_operation(operation, service, start_time=start_time, outcome='failed')
+            break
+
+    l_failed = [service for service, result in d_results.items() if not result]
+    if l_failed and raise_on_error:
+        raise RuntimeError('can not {action} services "{services}"'.format(action=action, services=', '.join(l_failed)))
+    return d_results
+
+
+def _is_service_job_done(action: str, d_properties: Dict[str, str], d_properties_before: Dict[str, str]) -> Tuple[bool, bool]:
+    """
+    returns (is_done, is_ok) - a service is only done when no job is queued for it anymore
+
+    >>> before = {'ActiveState': 'inactive', 'Result': 'success', 'Job': '', 'InactiveExitTimestampMonotonic': '0'}
+    >>> assert _is_service_job_done('start', {'ActiveState': 'failed', 'Result': 'exit-code', 'Job': '42'}, before) == (False, False)
+    >>> assert _is_service_job_done('start', {'ActiveState': 'failed', 'Result': 'exit-code', 'Job': ''}, before) == (True, False)
+    >>> assert _is_service_job_done('start', {'ActiveState': 'active', 'Result': 'success', 'Job': ''}, before) == (True, True)
+    >>> # a oneshot service without RemainAfterExit returns to inactive, after it left inactive
+    >>> after = {'ActiveState': 'inactive', 'Result': 'success', 'Job': '', 'InactiveExitTimestampMonotonic': '123'}
+    >>> assert _is_service_job_done('start', after, before) == (True, True)
+    >>> # a start job that could not be queued (masked unit) - the unit never left inactive
+    >>> assert _is_service_job_done('start', before, before) == (True, False)
+    >>> # waiting for an automatic restart
+    >>> assert _is_service_job_done('start', {'ActiveState': 'activating', 'Result': 'exit-code', 'Job': ''}, before) == (False, False)
+    >>> assert _is_service_job_done('stop', {'ActiveState': 'failed', 'Result': 'exit-code', 'Job': ''}, before) == (True, True)
+    """
+    active_state = d_properties.get('ActiveState', '')
+    if d_properties.get('Job', '') not in ('', '0') or active_state in ('activating', 'deactivating', 'reloading'):
+        return False, False
+    if action == 'start':
+        has_run = d_properties.get('InactiveExitTimestampMonotonic', '') != d_properties_before.get('InactiveExitTimestampMonotonic', '')
+        is_ok = active_state == 'active' or (active_state == 'inactive' and d_properties.get('Result', '') == 'success' and has_run)
+    else:
+        is_ok = active_state in ('inactive', 'failed')
+    return True, is_ok
 
 
 def set_inotify_watches(max_user_watches: int = 512 * 1024) -> None:
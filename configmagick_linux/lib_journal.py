@@ -0,0 +1,261 @@
+# STDLIB
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+# PROJECT
+try:
+    from . import lib_facts                     # type: ignore # pragma: no cover
+except ImportError:
+    import lib_facts                            # type: ignore # pragma: no cover
+
+logger = logging.getLogger()
+
+
+class ConfJournal(object):
+    def __init__(self) -> None:
+        self.enabled = True                                             # type: bool
+        # None = "journal.jsonl" in the cache directory, see lib_facts.get_path_cache_dir
+        self.path_journal_file = None                                   # type: Union[pathlib.Path, None]
+        # when the journal grows beyond that size, only the last entries of every operation and target are kept
+        self.compact_size_bytes = 4 * 1024 * 1024                       # type: int
+        self.compact_keep_entries = 10                                  # type: int
+
+
+conf_journal = ConfJournal()
+
+
+class JournalEntry(object):
+    def __init__(self) -> None:
+        self.timestamp = 0.0            # type: float
+        self.operation = ''             # type: str     # 'install', 'uninstall', 'start_service', ...
+        self.target = ''                # type: str     # the package or service
+        self.duration = 0.0             # type: float
+        self.outcome = ''               # type: str     # 'ok', 'failed' or 'satisfied' (nothing had to be done)
+        self.fingerprint = ''           # type: str     # the state the outcome is based on, empty if not memoizable
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, d_entry: Dict[str, Any]) -> 'JournalEntry':
+        journal_entry = cls()
+        for key in journal_entry.__dict__:
+            if key not in d_entry:
+                raise ValueError('journal entry key "{key}" is missing'.format(key=key))
+            setattr(journal_entry, key, d_entry[key])
+        return journal_entry
+
+
+# index of the last entry for each (operation, target), read incrementally from the journal file
+_d_last_entries = dict()                # type: Dict[Tuple[str, str], JournalEntry]
+_journal_offset = 0                     # type: int
+_path_indexed_journal_file = None       # type: Union[pathlib.Path, None]
+_journal_lock = threading.Lock()
+
+
+def get_path_journal_file(create_dir: bool = False) -> pathlib.Path:
+    if conf_journal.path_journal_file is not None:
+        path_journal_file = pathlib.Path(conf_journal.path_journal_file)
+        if create_dir:
+            path_journal_file.parent.mkdir(parents=True, exist_ok=True)
+    else:
+        path_journal_file = lib_facts.get_path_cache_dir(create=create_dir) / 'journal.jsonl'
+    return path_journal_file
+
+
+def record_operation(operation: str, target: str, start_time: float, outcome: str, fingerprint: str = '') -> None:
+    """
+    appends one line to the journal - the journal is only an optimization, so write errors are logged and ignored
+    """
+    if not conf_journal.enabled:
+        return
+    journal_entry = JournalEntry()
+    journal_entry.timestamp = time.time()
+    journal_entry.operation = operation
+    journal_entry.target = target
+    journal_entry.duration = round(journal_entry.timestamp - start_time, 3)
+    journal_entry.outcome = outcome
+    journal_entry.fingerprint = fingerprint
+    line = json.dumps(journal_entry.to_dict(), separators=(',', ':')) + '\n'
+    with _journal_lock:
+        # noinspection PyBroadException
+        try:
+            path_journal_file = get_path_journal_file(create_dir=True)
+            with open(str(path_journal_file), mode='a', encoding='utf-8') as journal_file:
+                journal_file.write(line)
+            if path_journal_file.stat().st_size > conf_journal.compact_size_bytes:
+                _compact_journal(path_journal_file)
+        except Exception:
+            logger.debug('can not write to the journal')
+
+
+def get_last_entry(operation: str, target: str) -> Union[JournalEntry, None]:
+    if not conf_journal.enabled:
+        return None
+    with _journal_lock:
+        # noinspection PyBroadException
+        try:
+            _update_index()
+        except Exception:
+            # an unreadable journal just means that nothing is known about former runs
+            logger.debug('can not read the journal')
+            return None
+        return _d_last_entries.get((operation, target))
+
+
+def is_operation_converged(operation: str, target: str, fingerprint: str) -> bool:
+    """
+    returns True if the last run of the operation succeeded, based on the same fingerprint
+
+    >>> import tempfile
+    >>> path_journal_file_save = conf_journal.path_journal_file
+    >>> conf_journal.path_journal_file = pathlib.Path(tempfile.mkdtemp()) / 'journal.jsonl'
+    >>> assert not is_operation_converged('install', 'test', fingerprint='1')
+    >>> record_operation('install', 'test', start_time=time.time(), outcome='ok', fingerprint='1')
+    >>> assert is_operation_converged('install', 'test', fingerprint='1')
+    >>> assert not is_operation_converged('install', 'test', fingerprint='2')
+    >>> record_operation('install', 'test', start_time=time.time(), outcome='failed', fingerprint='1')
+    >>> assert not is_operation_converged('install', 'test', fingerprint='1')
+    >>> conf_journal.path_journal_file = path_journal_file_save
+
+    """
+    if not fingerprint:
+        return False
+    journal_entry = get_last_entry(operation=operation, target=target)
+    if journal_entry is None:
+        return False
+    return journal_entry.fingerprint == fingerprint and journal_entry.outcome in ('ok', 'satisfied')
+
+
+def get_operation_statistics(operation: str = 'install',
+                             l_path_journal_files: Union[List[pathlib.Path], None] = None) -> Dict[str, Dict[str, float]]:
+    """
+    returns {<target>: {'count': ..., 'total': ..., 'mean': ..., 'max': ...}} of the durations of the operations that succeeded.
+    pass the journals of several hosts to get the statistics across the fleet.
+
+    >>> import tempfile
+    >>> path_journal_file = pathlib.Path(tempfile.mkdtemp()) / 'journal.jsonl'
+    >>> path_journal_file_save = conf_journal.path_journal_file
+    >>> conf_journal.path_journal_file = path_journal_file
+    >>> record_operation('install', 'test', start_time=time.time() - 2, outcome='ok')
+    >>> record_operation('install', 'test', start_time=time.time() - 4, outcome='ok')
+    >>> record_operation('install', 'test', start_time=time.time(), outcome='satisfied')
+    >>> record_operation('install', 'test', start_time=time.time() - 100, outcome='failed')
+    >>> conf_journal.path_journal_file = path_journal_file_save
+    >>> with open(str(path_journal_file), mode='ab') as journal_file:
+    ...     _ = journal_file.write(b'\\xff\\xfe not utf-8\\n')
+    ...     _ = journal_file.write(b'{"timestamp":0,"operation":"install","target":"test","duration":"x","outcome":"ok","fingerprint":""}\\n')
+    >>> d_statistics = get_operation_statistics(l_path_journal_files=[path_journal_file])
+    >>> assert d_statistics['test']['count'] == 2
+    >>> assert 2.9 < d_statistics['test']['mean'] < 3.5
+
+    """
+    if l_path_journal_files is None:
+        l_path_journal_files = [get_path_journal_file()]
+
+    d_durations = dict()                                            # type: Dict[str, List[float]]
+    for path_journal_file in l_path_journal_files:
+        if not pathlib.Path(path_journal_file).is_file():
+            continue
+        # journals might be copied from other hosts - skip whatever can not be used
+        with open(str(path_journal_file), mode='r', encoding='utf-8', errors='replace') as journal_file:
+            for line in journal_file:
+                journal_entry = _parse_journal_line(line)
+                if journal_entry is None or journal_entry.operation != operation or journal_entry.outcome != 'ok':
+                    continue
+                if isinstance(journal_entry.duration, bool) or not isinstance(journal_entry.duration, (int, float)):
+                    continue
+                d_durations.setdefault(journal_entry.target, []).append(journal_entry.duration)
+
+    d_statistics = dict()                                           # type: Dict[str, Dict[str, float]]
+    for target, l_durations in d_durations.items():
+        d_statistics[target] = {'count': len(l_durations),
+                                'total': sum(l_durations),
+                                'mean': sum(l_durations) / len(l_durations),
+                                'max': max(l_durations)}
+    return d_statistics
+
+
+def _update_index() -> None:
+    """ reads the lines appended since the last call - must be called with the journal lock held """
+    global _journal_offset, _path_indexed_journal_file
+    path_journal_file = get_path_journal_file()
+    try:
+        journal_size = path_journal_file.stat().st_size
+    except OSError:
+        journal_size = 0
+
+    # the journal was switched, removed or truncated
+    if path_journal_file != _path_indexed_journal_file or journal_size < _journal_offset:
+        _d_last_entries.clear()
+        _journal_offset = 0
+        _path_indexed_journal_file = path_journal_file
+
+    if journal_size == _journal_offset:
+        return
+
+    with open(str(path_journal_file), mode='rb') as journal_file:
+        journal_file.seek(_journal_offset)
+        data = journal_file.read()
+    # only consume complete lines, another process might be writing just now
+    data_length = data.rfind(b'\n') + 1
+    for line in data[:data_length].decode('utf-8', errors='replace').splitlines():
+        journal_entry = _parse_journal_line(line)
+        if journal_entry is not None:
+            _d_last_entries[(journal_entry.operation, journal_entry.target)] = journal_entry
+    _journal_offset = _journal_offset + data_length
+
+
+def _compact_journal(path_journal_file: pathlib.Path) -> None:
+    """
+    keeps the last conf_journal.compact_keep_entries entries of every operation and target -
+    if that is still too big, only the last entry. lines appended by other processes during the rewrite might get lost.
+
+    >>> path_journal_file = pathlib.Path(tempfile.mkdtemp()) / 'journal.jsonl'
+    >>> path_journal_file_save, compact_size_bytes_save = conf_journal.path_journal_file, conf_journal.compact_size_bytes
+    >>> conf_journal.path_journal_file, conf_journal.compact_size_bytes = path_journal_file, 10 ** 9
+    >>> for index in range(conf_journal.compact_keep_entries + 5):
+    ...     record_operation('install', 'test', start_time=time.time(), outcome='ok', fingerprint=str(index))
+    >>> _compact_journal(path_journal_file)
+    >>> assert len(path_journal_file.read_text().splitlines()) == conf_journal.compact_keep_entries
+    >>> assert is_operation_converged('install', 'test', fingerprint=str(conf_journal.compact_keep_entries + 4))
+    >>> conf_journal.path_journal_file, conf_journal.compact_size_bytes = path_journal_file_save, compact_size_bytes_save
+
+    """
+    d_entries = dict()                                              # type: Dict[Tuple[str, str], List[str]]
+    with open(str(path_journal_file), mode='r', encoding='utf-8', errors='replace') as journal_file:
+        for line in journal_file:
+            journal_entry = _parse_journal_line(line)
+            if journal_entry is not None:
+                l_lines = d_entries.setdefault((journal_entry.operation, journal_entry.target), [])
+                l_lines.append(line if line.endswith('\n') else line + '\n')
+                del l_lines[:-conf_journal.compact_keep_entries]
+
+    l_compacted = [line for l_lines in d_entries.values() for line in l_lines]
+    if sum(len(line) for line in l_compacted) > conf_journal.compact_size_bytes // 2:
+        l_compacted = [l_lines[-1] for l_lines in d_entries.values()]
+    # entries of different targets might get reordered, but the order per operation and target stays the same
+    l_compacted.sort(key=lambda compacted_line: _parse_journal_line(compacted_line).timestamp)  # type: ignore
+
+    fd, path_tmp_file = tempfile.mkstemp(dir=str(path_journal_file.parent), prefix=path_journal_file.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode='w', encoding='utf-8') as tmp_file:
+            tmp_file.writelines(l_compacted)
+        os.replace(path_tmp_file, str(path_journal_file))
+    except OSError:
+        os.unlink(path_tmp_file)
+        raise
+
+
+def _parse_journal_line(line: str) -> Union[JournalEntry, None]:
+    # noinspection PyBroadException
+    try:
+        return JournalEntry.from_dict(json.loads(line))
+    except Exception:
+        return None